@@ -1,20 +1,30 @@
+import time
+
+STARTUP_TIC = time.perf_counter()
+
 import http.server
+import importlib
 import io
 import os
 import glob
 import threading
 import urllib.parse
-import time
 import json
+
+_tic = time.perf_counter()
 import numpy as np
-import cv2
-from scipy.optimize import minimize
-from inky.auto import auto
-from PIL import Image
-from dither_engine import dither_to_indexed, apply_adjustments, get_palette_list
-
-# Initialize Inky
-inky = auto()
+
+# Heavy modules are imported inside the functions that use them (or by the
+# warm-up thread) so the HTTP socket can be bound before OpenCV, SciPy, Numba
+# and the display load. numpy is the only one loaded before binding.
+HEAVY_MODULES = ["cv2", "PIL.Image", "scipy.optimize", "dither_engine", "tone_optimizer"]
+IMPORT_TIMES = {"numpy": time.perf_counter() - _tic}
+JIT_TIME = None
+
+# The display is probed first by the warm-up thread; inky stays None if it fails.
+inky = None
+inky_ready = threading.Event()
+INKY_PROBE_TIME = None
 inky_lock = threading.Lock()
 
 IMG_DIR = "img"
@@ -30,33 +40,113 @@ INKY_COLOURS = np.array([
 ], dtype="float32")
 HUE_BOUNDS = [(0.5, 3), (0, 2), (-20, 40), (60, 150), (0.4, 2.2), (0.8, 3), (-0.2, 0.2)]
 HUE_KEYS = ["sat", "vibrance", "blk", "wht", "gam", "contrast", "hue_rot"]
+HUE_START = [1.1, 0.5, 0.0, 100.0, 1.0, 1.0, 0.0]
+# Stop once the loss improves by less than this fraction over TONE_PATIENCE iterations.
+TONE_MIN_IMPROVEMENT = 1e-3
+TONE_PATIENCE = 25
+TONE_MAXITER = 400
+# Warm-start from remembered fits within TONE_MAX_DISTANCE of the new image's
+# colour signature; fits within TONE_MERGE_DISTANCE are treated as duplicates.
+TONE_MAX_DISTANCE = 0.15
+TONE_MERGE_DISTANCE = 0.02
+# Kept outside IMG_DIR so the /img/ handler never serves it.
+TONE_MEMORY_PATH = "tone_memory.json"
+tone_fitter = None
+tone_fitter_lock = threading.Lock()
 if not os.path.exists(IMG_DIR):
     os.makedirs(IMG_DIR)
 
 
-def calculate_hue_loss(params, source, palette):
-    adjusted = apply_adjustments(source, *params)
+def init_inky():
+    global inky, INKY_PROBE_TIME
+    tic = time.perf_counter()
+    try:
+        from inky.auto import auto
+        inky = auto()
+    except Exception as e:
+        print(f"Inky Init Error: {e}")
+    finally:
+        INKY_PROBE_TIME = time.perf_counter() - tic
+        inky_ready.set()
+
+
+def print_startup_report(bound_in):
+    # Wall-clock times: an upload that imports the same module during warm-up
+    # makes the warm-up wait on it. Use `python -X importtime` for exact costs.
+    print(f"Server bound in {bound_in:0.4f} seconds")
+    status = "found" if inky is not None else "not found"
+    print(f"  display probe ({status}) {INKY_PROBE_TIME:0.4f} seconds")
+    for name, seconds in list(IMPORT_TIMES.items()):
+        print(f"  import {name:<16} {seconds:0.4f} seconds")
+    if JIT_TIME is not None:
+        print(f"  dither JIT compile    {JIT_TIME:0.4f} seconds")
+    print(f"Ready in {time.perf_counter() - STARTUP_TIC:0.4f} seconds")
+
+
+def warm_up(bound_in):
+    global JIT_TIME
+    # Probe first so /reload can reach the display without waiting on imports,
+    # and so the import timings below do not overlap the probe's own imports.
+    init_inky()
+    for name in HEAVY_MODULES:
+        try:
+            tic = time.perf_counter()
+            importlib.import_module(name)
+            IMPORT_TIMES[name] = time.perf_counter() - tic
+        except Exception as e:
+            print(f"Import Error ({name}): {e}")
+    try:
+        # Compile the numba kernel now instead of on the first upload.
+        from dither_engine import dither_to_indexed
+        tic = time.perf_counter()
+        sample = np.zeros((2, 2, 3), dtype=np.float32)
+        dither_to_indexed(sample, INKY_COLOURS)
+        JIT_TIME = time.perf_counter() - tic
+    except Exception as e:
+        print(f"JIT Warm-up Error: {e}")
+    print_startup_report(bound_in)
+
+
+def get_tone_fitter():
+    global tone_fitter
+    with tone_fitter_lock:
+        if tone_fitter is None:
+            from tone_optimizer import ToneOptimizer
+            tone_fitter = ToneOptimizer(
+                HUE_BOUNDS,
+                HUE_START,
+                memory_path=TONE_MEMORY_PATH,
+                min_improvement=TONE_MIN_IMPROVEMENT,
+                patience=TONE_PATIENCE,
+                maxiter=TONE_MAXITER,
+                max_distance=TONE_MAX_DISTANCE,
+                merge_distance=TONE_MERGE_DISTANCE,
+            )
+    return tone_fitter
+
+
+def calculate_hue_loss(params, source, palette, adjust):
+    adjusted = adjust(source, *params)
     pix = adjusted.reshape(-1, 3)
     diff = pix[:, np.newaxis, :] - palette[np.newaxis, :, :]
     nearest = palette[np.argmin(np.sum(diff**2, axis=2), axis=1)]
     return np.mean(np.sum((nearest - source.reshape(-1, 3))**2, axis=1))
 
 
-def prepare_for_inky(image):
+def prepare_for_inky(image, name=None):
     if image.mode == "P":
         return image
 
+    import cv2
+    from PIL import Image
+    from dither_engine import dither_to_indexed, apply_adjustments, get_palette_list
+
     img_rgb = np.array(image.convert("RGB"), dtype=np.uint8)
     img_lab = cv2.cvtColor(img_rgb.astype(np.float32) / 255.0, cv2.COLOR_RGB2LAB)
-    res = minimize(
-        calculate_hue_loss,
-        [1.1, 0.5, 0.0, 100.0, 1.0, 1.0, 0.0],
-        args=(img_lab, INKY_COLOURS),
-        method="Nelder-Mead",
-        options={"maxiter": 400},
-        bounds=HUE_BOUNDS,
+    best, _ = get_tone_fitter().optimize(
+        calculate_hue_loss, img_lab, args=(INKY_COLOURS, apply_adjustments), name=name
     )
-    params = dict(zip(HUE_KEYS, res.x))
+    params = dict(zip(HUE_KEYS, best))
     adjusted = apply_adjustments(img_lab, **params)
     indexed = dither_to_indexed(adjusted, INKY_COLOURS, c=0.013 * 2)
     out = Image.fromarray(indexed, mode="P")
@@ -70,6 +160,9 @@ def to_png_bytes(image):
     return out.getvalue()
 
 def process_upload_image(img_bytes, crop=None):
+    import cv2
+    from PIL import Image
+
     img_np = np.frombuffer(img_bytes, dtype=np.uint8)
     img_bgr = cv2.imdecode(img_np, cv2.IMREAD_COLOR)
     if img_bgr is None:
@@ -166,6 +259,10 @@ def parse_multipart_form(headers, body):
 def update_inky_task(img_bytes):
     with inky_lock:
         try:
+            inky_ready.wait()
+            if inky is None:
+                raise RuntimeError("Inky display not available")
+            from PIL import Image
             img = Image.open(io.BytesIO(img_bytes))
             img = prepare_for_inky(img)
             inky.set_image(img)
@@ -293,7 +390,13 @@ def get_full_html():
                 fetch('/status').then(r => r.json()).then(data => {{
                     const dot = document.getElementById('status-dot');
                     const txt = document.getElementById('status-text');
-                    if(data.busy) {{
+                    if(!data.ready) {{
+                        dot.className = 'dot busy';
+                        txt.innerText = 'Screen is STARTING';
+                    }} else if(!data.display) {{
+                        dot.className = 'dot busy';
+                        txt.innerText = 'NO DISPLAY found';
+                    }} else if(data.busy) {{
                         dot.className = 'dot busy';
                         txt.innerText = 'Screen is BUSY';
                     }} else {{
@@ -404,7 +507,16 @@ class InkyHandler(http.server.BaseHTTPRequestHandler):
             self.send_header("Content-type", "application/json")
             self.end_headers()
             busy = "true" if inky_lock.locked() else "false"
-            self.wfile.write(f'{{"busy": {busy}}}'.encode())
+            ready = "true" if inky_ready.is_set() else "false"
+            display = "true" if inky is not None else "false"
+            self.wfile.write(f'{{"busy": {busy}, "ready": {ready}, "display": {display}}}'.encode())
+            return
+
+        if self.path == "/optimizer":
+            self.send_response(200)
+            self.send_header("Content-type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps(get_tone_fitter().summary()).encode())
             return
 
         if self.path.startswith("/img/"):
@@ -442,11 +554,14 @@ class InkyHandler(http.server.BaseHTTPRequestHandler):
                     if isinstance(maybe_crop, dict):
                         crop = maybe_crop
 
+                from PIL import Image
                 upload_bytes = process_upload_image(raw_bytes, crop)
-                prepared = prepare_for_inky(Image.open(io.BytesIO(upload_bytes)))
+                next_name = os.path.join(IMG_DIR, f"img_{int(time.time())}.png")
+                prepared = prepare_for_inky(
+                    Image.open(io.BytesIO(upload_bytes)), name=os.path.basename(next_name)
+                )
                 prepared_bytes = to_png_bytes(prepared)
 
-                next_name = os.path.join(IMG_DIR, f"img_{int(time.time())}.png")
                 with open(next_name, "wb") as f:
                     f.write(prepared_bytes)
 
@@ -483,10 +598,13 @@ class InkyHandler(http.server.BaseHTTPRequestHandler):
                 self.send_error(400, "Missing file")
                 return
 
-            prepared = prepare_for_inky(Image.open(io.BytesIO(img_bytes)))
+            from PIL import Image
+            next_name = os.path.join(IMG_DIR, f"img_{int(time.time())}.png")
+            prepared = prepare_for_inky(
+                Image.open(io.BytesIO(img_bytes)), name=os.path.basename(next_name)
+            )
             prepared_bytes = to_png_bytes(prepared)
 
-            next_name = os.path.join(IMG_DIR, f"img_{int(time.time())}.png")
             with open(next_name, "wb") as f:
                 f.write(prepared_bytes)
 
@@ -502,4 +620,6 @@ class InkyHandler(http.server.BaseHTTPRequestHandler):
 if __name__ == "__main__":
     server = http.server.HTTPServer(('0.0.0.0', 8000), InkyHandler)
     print("Inky Dash running on http://<pi-ip>:8000")
+    bound_in = time.perf_counter() - STARTUP_TIC
+    threading.Thread(target=warm_up, args=(bound_in,), daemon=True).start()
     server.serve_forever()
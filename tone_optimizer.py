@@ -0,0 +1,221 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from scipy.optimize import minimize
+
+
+# Bump when the signature or file layout changes; older files are ignored.
+MEMORY_VERSION = 2
+SIGNATURE_SIZE = 8
+
+
+class _EarlyStop(Exception):
+    pass
+
+
+def colour_signature(img_lab):
+    # Per-channel mean/std plus L percentiles, scaled to roughly unit range
+    l, a, b = img_lab[..., 0], img_lab[..., 1], img_lab[..., 2]
+    p5, p95 = np.percentile(l, [5, 95])
+    return [
+        float(np.mean(l)) / 100.0, float(np.std(l)) / 50.0,
+        float(np.mean(a)) / 128.0, float(np.std(a)) / 64.0,
+        float(np.mean(b)) / 128.0, float(np.std(b)) / 64.0,
+        float(p5) / 100.0, float(p95) / 100.0,
+    ]
+
+
+class ToneOptimizer:
+    """Nelder-Mead tone fit that warm-starts from similar past images.
+
+    Fitted parameters are remembered per colour signature; a new image starts
+    from the nearest remembered entry within max_distance. The search stops
+    once the best loss improved by less than min_improvement (relative) over
+    the last `patience` iterations. Each run records the iterations early
+    stopping saved against the maxiter budget and the evaluations a warm start
+    saved against the mean cold start. A match closer than merge_distance is
+    replaced only when the new fit has an equal or lower loss.
+    """
+
+    def __init__(self, bounds, x0, memory_path=None, min_improvement=1e-3,
+                 patience=25, maxiter=400, max_distance=0.15, merge_distance=0.02,
+                 max_entries=64, max_log=50):
+        self.bounds = bounds
+        self.x0 = list(x0)
+        self.memory_path = memory_path
+        self.min_improvement = min_improvement
+        self.patience = patience
+        self.maxiter = maxiter
+        self.max_distance = max_distance
+        self.merge_distance = merge_distance
+        self.entries = deque(maxlen=max_entries)
+        self.log = deque(maxlen=max_log)
+        self.cold_runs = 0
+        self.cold_nfev = 0
+        self.total_iterations_saved = 0
+        self.total_evaluations_saved = 0
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not self.memory_path or not os.path.exists(self.memory_path):
+            return
+        try:
+            with open(self.memory_path) as f:
+                data = json.load(f)
+            if not isinstance(data, dict) or data.get("version") != MEMORY_VERSION:
+                print("Tone Memory: ignoring file from another version")
+                return
+            entries = [e for e in data.get("entries", []) if self.valid_entry(e)]
+            log = [r for r in data.get("log", []) if isinstance(r, dict)]
+            cold_runs = int(data.get("cold_runs", 0))
+            cold_nfev = int(data.get("cold_nfev", 0))
+            total_iterations_saved = int(data.get("total_iterations_saved", 0))
+            total_evaluations_saved = int(data.get("total_evaluations_saved", 0))
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            print(f"Tone Memory Load Error: {e}")
+            return
+        self.entries.extend(entries)
+        self.log.extend(log)
+        self.cold_runs = cold_runs
+        self.cold_nfev = cold_nfev
+        self.total_iterations_saved = total_iterations_saved
+        self.total_evaluations_saved = total_evaluations_saved
+
+    def valid_entry(self, entry):
+        try:
+            signature = np.asarray(entry["signature"], dtype=np.float64)
+            params = np.asarray(entry["params"], dtype=np.float64)
+            loss = float(entry["loss"])
+        except (KeyError, TypeError, ValueError):
+            return False
+        return (
+            signature.shape == (SIGNATURE_SIZE,)
+            and params.shape == (len(self.bounds),)
+            and bool(np.all(np.isfinite(signature)) and np.all(np.isfinite(params)))
+            and np.isfinite(loss)
+        )
+
+    def save(self):
+        if not self.memory_path:
+            return
+        data = {
+            "version": MEMORY_VERSION,
+            "entries": list(self.entries),
+            "log": list(self.log),
+            "cold_runs": self.cold_runs,
+            "cold_nfev": self.cold_nfev,
+            "total_iterations_saved": self.total_iterations_saved,
+            "total_evaluations_saved": self.total_evaluations_saved,
+        }
+        tmp_path = self.memory_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.memory_path)
+
+    def nearest(self, signature):
+        best, best_dist = None, self.max_distance
+        for entry in self.entries:
+            dist = float(np.linalg.norm(np.subtract(entry["signature"], signature)))
+            if dist <= best_dist:
+                best, best_dist = entry, dist
+        return best, best_dist
+
+    def optimize(self, loss, source, args=(), name=None):
+        signature = colour_signature(source)
+        with self.lock:
+            match, match_dist = self.nearest(signature)
+        warm_start = match is not None
+        lo, hi = np.array(self.bounds, dtype=np.float64).T
+        start = np.clip(match["params"] if warm_start else self.x0, lo, hi)
+
+        state = {"nfev": 0, "best_x": start, "best_f": np.inf, "history": []}
+
+        def tracked(x):
+            state["nfev"] += 1
+            f = loss(x, source, *args)
+            if f < state["best_f"]:
+                state["best_x"], state["best_f"] = np.array(x), f
+            return f
+
+        def callback(xk):
+            history = state["history"]
+            history.append(state["best_f"])
+            if len(history) > self.patience:
+                before = history[-self.patience - 1]
+                if before - history[-1] < self.min_improvement * abs(before):
+                    raise _EarlyStop()
+
+        stopped_early = False
+        try:
+            res = minimize(
+                tracked,
+                start,
+                method="Nelder-Mead",
+                callback=callback,
+                options={"maxiter": self.maxiter},
+                bounds=self.bounds,
+            )
+            if res.fun < state["best_f"]:
+                state["best_x"], state["best_f"] = res.x, res.fun
+        except _EarlyStop:
+            stopped_early = True
+
+        params = [float(v) for v in state["best_x"]]
+        nfev, nit = state["nfev"], len(state["history"])
+        with self.lock:
+            iterations_saved = max(0, self.maxiter - nit) if stopped_early else 0
+            evaluations_saved = 0
+            if warm_start and self.cold_runs:
+                evaluations_saved = max(0, round(self.cold_nfev / self.cold_runs) - nfev)
+            self.total_iterations_saved += iterations_saved
+            self.total_evaluations_saved += evaluations_saved
+            if not warm_start:
+                self.cold_runs += 1
+                self.cold_nfev += nfev
+            record = {
+                "time": time.time(),
+                "name": name,
+                "nfev": nfev,
+                "nit": nit,
+                "iterations_saved": iterations_saved,
+                "evaluations_saved": evaluations_saved,
+                "warm_start": warm_start,
+                "stopped_early": stopped_early,
+                "loss": float(state["best_f"]),
+            }
+            self.log.append(record)
+            entry = {"signature": signature, "params": params, "loss": record["loss"]}
+            if warm_start and match_dist <= self.merge_distance and match in self.entries:
+                # Near-duplicate: keep whichever of the two fits is better.
+                if entry["loss"] <= match["loss"]:
+                    self.entries.remove(match)
+                    self.entries.append(entry)
+            else:
+                self.entries.append(entry)
+            try:
+                self.save()
+            except OSError as e:
+                print(f"Tone Memory Save Error: {e}")
+        print(
+            f"Tone fit: {nfev} evaluations in {nit} iterations,"
+            f" {iterations_saved} iterations saved vs budget,"
+            f" {evaluations_saved} evaluations saved vs cold start"
+            f" (warm start: {warm_start}, early stop: {stopped_early})"
+        )
+        return params, record
+
+    def summary(self):
+        with self.lock:
+            return {
+                "remembered": len(self.entries),
+                "cold_runs": self.cold_runs,
+                "mean_cold_nfev": self.cold_nfev / self.cold_runs if self.cold_runs else None,
+                "iterations_saved": self.total_iterations_saved,
+                "evaluations_saved": self.total_evaluations_saved,
+                "recent": list(self.log),
+            }